@@ -1,8 +1,15 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import re
 import json
 import time
 import logging
+import queue
+import threading
+from functools import lru_cache
+from collections import OrderedDict
 from datetime import datetime
 import firebase_admin
 from firebase_admin import credentials, firestore
@@ -20,22 +27,45 @@ logger = logging.getLogger("BetBot")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "YOUR_TOKEN_HERE")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "YOUR_CHAT_ID_HERE")
 FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS_JSON", "")
+TELEGRAM_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
 
 # --- SETTINGS ---
 ORIGINAL_STAKE = 10.0
 MAX_CHASE_LEVEL = 4
 SLEEP_TIME = 60
-MINUTES_REGULAR_BET = [36, 37]
+SLEEP_TIME_IDLE = 300      # nothing live
+SLEEP_TIME_NEAR_BET = 20   # a first-half match is approaching the bet window
+SLEEP_TIME_MAX = 600       # cap for error backoff
+TELEGRAM_MAX_LEN = 4000
+MINUTES_REGULAR_BET = frozenset({36, 37})
+MINUTES_NEAR_BET = frozenset(range(33, 38))
+MAX_TRACKED_MATCHES = 2048
+BET_SCORES = frozenset({'1-1', '2-2', '3-3'})
 
 # --- FILTERS ---
 ALLOWED_LEAGUES = ['Campeonato Brasileiro Série A', 'Segunda Division, Apertura', 'Copa do Brasil', 'Premier League']
 EXCLUDED_LEAGUES = ['USA', 'Poland','Australia', 'Mexico', 'Wales', 'Germany', 'England Amateur', 'U19', 'U21', 'Friendly']
 AMATEUR_KEYWORDS = ['amateur', 'youth', 'reserves', 'friendly', 'u23', 'u21','u20', 'women', 'college']
+# One compiled alternation per list scans each name in a single pass
+ALLOWED_LEAGUES_RE = re.compile('|'.join(re.escape(x.lower()) for x in ALLOWED_LEAGUES))
+EXCLUDED_KEYWORDS_RE = re.compile('|'.join(re.escape(x.lower()) for x in EXCLUDED_LEAGUES + AMATEUR_KEYWORDS))
 
 # --- GLOBALS ---
 SOFASCORE_CLIENT = None
 firebase_manager = None
-LOCAL_TRACKED_MATCHES = {}
+LOCAL_TRACKED_MATCHES = OrderedDict()  # LRU, bounded by MAX_TRACKED_MATCHES
+CYCLE_ERRORS = 0
+LAST_EVENTS = []  # last successfully fetched live list
+LAST_UNRESOLVED = None  # last unresolved_bets read, kept current by process_match; None until first read
+DEFAULT_MATCH_STATE = {'bet_placed': False}
+
+# Reuse one keep-alive connection to Telegram instead of a TLS handshake per message.
+# The adapter's Retry only covers failures before the request is sent; see _post_telegram for stale sockets
+TELEGRAM_SESSION = requests.Session()
+TELEGRAM_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.3)))
+TELEGRAM_QUEUE = queue.Queue()
+TELEGRAM_WORKER = None
+CYCLE_MESSAGES = []
 
 class FirebaseManager:
     def __init__(self, creds_json):
@@ -51,12 +81,10 @@ class FirebaseManager:
             self.db = firestore.client()
             logger.info("✅ Firebase Connection Ready.")
         except Exception as e:
-            logger.error(f"❌ Firebase Init Error: {e}")
+            logger.error("❌ Firebase Init Error: %s", e)
 
-    def is_state_locked(self):
-        try:
-            return len(self.db.collection('unresolved_bets').limit(1).get()) > 0
-        except: return False
+    def get_unresolved_bets(self):
+        return {doc.id: doc.to_dict() for doc in self.db.collection('unresolved_bets').stream()}
 
     def get_last_resolved_bet(self):
         try:
@@ -68,22 +96,69 @@ class FirebaseManager:
         data['placed_at'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
         self.db.collection('unresolved_bets').document(str(match_id)).set(data)
 
-    def get_unresolved_bet(self, match_id):
-        doc = self.db.collection('unresolved_bets').document(str(match_id)).get()
-        return doc.to_dict() if doc.exists else None
-
     def move_to_resolved(self, match_id, data, outcome):
         data.update({'outcome': outcome, 'resolved_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'), 'resolution_timestamp': firestore.SERVER_TIMESTAMP})
-        self.db.collection('resolved_bets').document(str(match_id)).set(data)
-        self.db.collection('unresolved_bets').document(str(match_id)).delete()
+        # One atomic commit so the bet is never in both collections (or neither)
+        batch = self.db.batch()
+        batch.set(self.db.collection('resolved_bets').document(str(match_id)), data)
+        batch.delete(self.db.collection('unresolved_bets').document(str(match_id)))
+        batch.commit()
         return True
 
+def _post_telegram(msg):
+    data = {'chat_id': TELEGRAM_CHAT_ID, 'text': msg, 'parse_mode': 'Markdown'}
+    for attempt in range(2):
+        try:
+            r = TELEGRAM_SESSION.post(TELEGRAM_URL, data=data, timeout=15)
+            return r.status_code == 200
+        # A pooled socket Telegram already closed fails after sending, which urllib3 won't
+        # retry for a POST; resend once on a fresh connection, accepting a rare duplicate
+        except requests.ConnectionError:
+            if attempt: return False
+        except: return False
+
+def _telegram_worker(q):
+    while True:
+        msg = q.get()
+        if msg is None: return
+        if not _post_telegram(msg):
+            logger.warning("Telegram send failed.")
+
+def start_telegram_worker():
+    global TELEGRAM_WORKER
+    if TELEGRAM_WORKER is None or not TELEGRAM_WORKER.is_alive():
+        TELEGRAM_WORKER = threading.Thread(target=_telegram_worker, args=(TELEGRAM_QUEUE,), name="TelegramWorker", daemon=True)
+        TELEGRAM_WORKER.start()
+
 def send_telegram(msg):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    try:
-        r = requests.post(url, data={'chat_id': TELEGRAM_CHAT_ID, 'text': msg, 'parse_mode': 'Markdown'}, timeout=15)
-        return r.status_code == 200
-    except: return False
+    # Sends happen on the worker thread so a slow Telegram API never stalls the scan loop
+    TELEGRAM_QUEUE.put(msg)
+
+# Stops the worker after it sends what is already queued, waiting at most timeout; the timeout
+# stays under Docker's default 10s stop grace so the browser close still runs. shutdown_bot()
+# also calls this on every 2h browser reboot and watchdog reset, so each of those can stall the
+# loop for up to timeout too. Later messages go to a fresh queue that the worker started by
+# initialize_bot_services() picks up.
+def drain_telegram(timeout=5):
+    global TELEGRAM_QUEUE, TELEGRAM_WORKER
+    worker = TELEGRAM_WORKER
+    if worker is None: return True
+    TELEGRAM_QUEUE.put(None)
+    TELEGRAM_QUEUE, TELEGRAM_WORKER = queue.Queue(), None
+    worker.join(timeout)
+    return not worker.is_alive()
+
+def flush_cycle_messages():
+    # Pack the cycle's alerts into as few posts as Telegram's message size allows
+    chunk = ''
+    for msg in CYCLE_MESSAGES:
+        if chunk and len(chunk) + 2 + len(msg) > TELEGRAM_MAX_LEN:
+            send_telegram(chunk)
+            chunk = msg
+        else:
+            chunk = f"{chunk}\n\n{msg}" if chunk else msg
+    if chunk: send_telegram(chunk)
+    CYCLE_MESSAGES.clear()
 
 def calculate_stake():
     last = firebase_manager.get_last_resolved_bet()
@@ -94,45 +169,79 @@ def calculate_stake():
         return float(ORIGINAL_STAKE * (2**seq)), seq + 1
     return ORIGINAL_STAKE, 1
 
-def process_match(match):
-    fid = str(match.id)
-    league = match.tournament.name
-    country = match.tournament.category.name
-    full_info = f"{league} {country}".lower()
+# Only a handful of distinct status descriptions exist, so each is classified once
+@lru_cache(maxsize=None)
+def get_match_phase(description):
+    status = (description or '').upper()
+    return '1H' if '1ST' in status else 'HT' if 'HALFTIME' in status else None
+
+# League metadata is stable, so the verdict is cached for the bot's lifetime
+@lru_cache(maxsize=4096)
+def is_league_allowed(league_id, league, country):
+    league_lower = league.lower()
+    if ALLOWED_LEAGUES_RE.search(league_lower): return True
+    return not EXCLUDED_KEYWORDS_RE.search(f"{league_lower} {country.lower()}")
 
-    if not any(x.lower() in league.lower() for x in ALLOWED_LEAGUES):
-        if any(x.lower() in full_info for x in EXCLUDED_LEAGUES + AMATEUR_KEYWORDS): return
+# A match in a league we bet on that hasn't had its 36' decision yet
+def is_bet_candidate(match):
+    t = match.tournament
+    if not is_league_allowed(t.id, t.name, t.category.name): return False
+    state = LOCAL_TRACKED_MATCHES.get(str(match.id))
+    return state is None or not state['bet_placed']
 
-    min_elapsed = match.total_elapsed_minutes
-    status = match.status.description.upper()
-    score = f"{match.home_score.current}-{match.away_score.current}"
-    
-    match_info = {'match_name': f"{match.home_team.name} vs {match.away_team.name}", 'league': league, 'country': country}
-    state = LOCAL_TRACKED_MATCHES.get(fid, {'bet_placed': False})
-    LOCAL_TRACKED_MATCHES[fid] = state
+def is_actionable(match):
+    phase = get_match_phase(match.status.description)
+    if phase == '1H': return match.total_elapsed_minutes in MINUTES_REGULAR_BET and is_bet_candidate(match)
+    # Only this process writes bets, so HT matches matter only while one may be open
+    return phase == 'HT' and (LAST_UNRESOLVED is None or bool(LAST_UNRESOLVED))
+
+def process_match(match, unresolved):
+    # Callers pass only matches that passed is_actionable: an allowed 1H match at 36'/37', or HT
+    fid = str(match.id)
 
     # 1. PLACE BET AT 36'
-    if '1ST' in status and min_elapsed in MINUTES_REGULAR_BET and not state['bet_placed']:
-        if not firebase_manager.is_state_locked():
-            if score in ['1-1', '2-2', '3-3']:
+    if get_match_phase(match.status.description) == '1H':
+        league = match.tournament.name
+        country = match.tournament.category.name
+
+        state = LOCAL_TRACKED_MATCHES.get(fid)
+        if state is None:
+            state = LOCAL_TRACKED_MATCHES[fid] = DEFAULT_MATCH_STATE.copy()
+            # Matches that never reach a resolved HT would otherwise stay here forever
+            if len(LOCAL_TRACKED_MATCHES) > MAX_TRACKED_MATCHES: LOCAL_TRACKED_MATCHES.popitem(last=False)
+        else:
+            LOCAL_TRACKED_MATCHES.move_to_end(fid)
+        if state['bet_placed']: return
+        # Any open bet locks the system until it resolves at HT
+        if not unresolved:
+            score = f"{match.home_score.current}-{match.away_score.current}"
+            if score in BET_SCORES:
+                match_name = f"{match.home_team.name} vs {match.away_team.name}"
                 stake, seq = calculate_stake()
-                data = {**match_info, '36_score': score, 'stake': stake, 'match_sequence': seq, 'bet_type': 'regular'}
+                data = {'match_name': match_name, 'league': league, 'country': country, '36_score': score, 'stake': stake, 'match_sequence': seq, 'bet_type': 'regular'}
                 firebase_manager.add_unresolved_bet(fid, data)
-                send_telegram(f"🎯 **BET PLACED (Match {seq})**\n⏱ 36' | {match_info['match_name']}\n🌍 {country} | 🏆 {league}\n🔢 Score: {score}\n💰 Stake: ${stake:.2f}")
+                unresolved[fid] = data
+                CYCLE_MESSAGES.append(f"🎯 **BET PLACED (Match {seq})**\n⏱ 36' | {match_name}\n🌍 {country} | 🏆 {league}\n🔢 Score: {score}\n💰 Stake: ${stake:.2f}")
         state['bet_placed'] = True
 
     # 2. CHECK HT RESULT
-    elif 'HALFTIME' in status:
-        unresolved = firebase_manager.get_unresolved_bet(fid)
-        if unresolved:
-            outcome = 'win' if score == unresolved['36_score'] else 'loss'
-            if firebase_manager.move_to_resolved(fid, unresolved, outcome):
-                emo = "✅ WIN" if outcome == 'win' else "❌ LOSS"
-                send_telegram(f"{emo} **HT Result**\n⚽️ {match_info['match_name']}\n🔢 Score: {score}\n🔓 System Unlocked.")
-                if fid in LOCAL_TRACKED_MATCHES: del LOCAL_TRACKED_MATCHES[fid]
+    # No league filter here: an open bet already passed it, and skipping it
+    # means a later filter change can never strand a bet (and the lock) unresolved
+    else:
+        bet = unresolved.get(fid)
+        if not bet: return
+        score = f"{match.home_score.current}-{match.away_score.current}"
+        outcome = 'win' if score == bet['36_score'] else 'loss'
+        if firebase_manager.move_to_resolved(fid, bet, outcome):
+            del unresolved[fid]
+            emo = "✅ WIN" if outcome == 'win' else "❌ LOSS"
+            match_name = f"{match.home_team.name} vs {match.away_team.name}"
+            CYCLE_MESSAGES.append(f"{emo} **HT Result**\n⚽️ {match_name}\n🔢 Score: {score}\n🔓 System Unlocked.")
+            if fid in LOCAL_TRACKED_MATCHES: del LOCAL_TRACKED_MATCHES[fid]
 
 def initialize_bot_services():
     global firebase_manager, SOFASCORE_CLIENT
+    start_telegram_worker()
     firebase_manager = FirebaseManager(FIREBASE_CREDENTIALS)
     try:
         SOFASCORE_CLIENT = SofascoreClient()
@@ -141,14 +250,53 @@ def initialize_bot_services():
     except: return False
 
 def shutdown_bot():
+    drain_telegram()
     if SOFASCORE_CLIENT: 
         try: SOFASCORE_CLIENT.close()
         except: pass
 
+def next_sleep_time(events):
+    if not events: return SLEEP_TIME_IDLE
+    # Poll faster only when a bet could really be placed: no open bet (known, not assumed)
+    # and an allowed, undecided match about to reach 36'
+    if LAST_UNRESOLVED is None or LAST_UNRESOLVED: return SLEEP_TIME
+    for m in events:
+        if get_match_phase(m.status.description) == '1H' and m.total_elapsed_minutes in MINUTES_NEAR_BET and is_bet_candidate(m):
+            return SLEEP_TIME_NEAR_BET
+    return SLEEP_TIME
+
+def error_backoff():
+    # A bet only resolves if its match is seen at HT, so never sleep through the HT break while one may be open
+    if LAST_UNRESOLVED is None or LAST_UNRESOLVED: return SLEEP_TIME
+    backoff = min(SLEEP_TIME * 2 ** (CYCLE_ERRORS - 1), SLEEP_TIME_MAX)
+    # Nor past 36' of a match we could still bet on; elapsed minutes follow the wall clock,
+    # so the last good scan still says when each window opens
+    first_bet_minute, last_bet_minute = min(MINUTES_REGULAR_BET), max(MINUTES_REGULAR_BET)
+    for m in LAST_EVENTS:
+        minute = m.total_elapsed_minutes
+        if get_match_phase(m.status.description) == '1H' and minute <= last_bet_minute and is_bet_candidate(m):
+            backoff = min(backoff, max((first_bet_minute - minute) * 60, SLEEP_TIME))
+    return backoff
+
+# Returns how long main() should sleep before the next scan
 def run_bot_cycle():
-    if not SOFASCORE_CLIENT: return
+    global CYCLE_ERRORS, LAST_EVENTS, LAST_UNRESOLVED
+    if not SOFASCORE_CLIENT: return SLEEP_TIME
     try:
-        events = SOFASCORE_CLIENT.get_events(live=True)
-        logger.info(f"Scanning {len(events)} live matches...")
-        for m in events: process_match(m)
-    except Exception as e: logger.error(f"Cycle Error: {e}")
+        LAST_EVENTS = events = SOFASCORE_CLIENT.get_events(live=True)
+        logger.info("Scanning %d live matches...", len(events))
+        # Most live matches are outside both windows; skip Firestore entirely when none qualify
+        candidates = [m for m in events if is_actionable(m)]
+        if candidates:
+            LAST_UNRESOLVED = unresolved = firebase_manager.get_unresolved_bets()
+            for m in candidates: process_match(m, unresolved)
+    except Exception as e:
+        logger.error("Cycle Error: %s", e)
+        # Back off while a backend is failing instead of hammering it every minute
+        CYCLE_ERRORS += 1
+        backoff = error_backoff()
+        logger.warning("%d consecutive failed cycles, backing off %ds", CYCLE_ERRORS, backoff)
+        return backoff
+    finally: flush_cycle_messages()
+    CYCLE_ERRORS = 0
+    return next_sleep_time(events)
@@ -10,6 +10,13 @@ import httpx
 from lxml import html
 from playwright.sync_api import Page
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 
 def get_today() -> str:
     """
@@ -84,7 +91,7 @@ def get_json(page: Page, url: str) -> dict:
                 # FIX: Pass the headers here!
                 response = client.get(url, headers=HEADERS)
                 response.raise_for_status()
-                return response.json()
+                return _loads(response.content)
         
         # This is the Playwright/Scraping path
         page.goto(url, wait_until="networkidle")
@@ -95,7 +102,7 @@ def get_json(page: Page, url: str) -> dict:
         if pre_text_list:
             json_string = pre_text_list[0].strip()
             try:
-                data = json.loads(json_string)
+                data = _loads(json_string)
                 if "error" in data and "code" in data["error"]:
                     code = data["error"]["code"]
                     # Note: We keep the console prints here as they were in the original code
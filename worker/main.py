@@ -16,6 +16,15 @@ def signal_handler(signum, frame):
     global RUNNING
     RUNNING = False
 
+# time.sleep resumes after a signal handler (PEP 475), so long waits are sliced to notice
+# RUNNING within a second; no locks, since an Event set from the handler can deadlock
+def sleep_while_running(seconds):
+    deadline = time.monotonic() + seconds
+    while RUNNING:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0: break
+        time.sleep(min(1, remaining))
+
 def main():
     global LAST_REBOOT, LAST_HEARTBEAT
     signal.signal(signal.SIGINT, signal_handler)
@@ -29,6 +38,7 @@ def main():
     send_telegram("🚀 **Live Score Bot Start**\nBotActive and Healthy.")
 
     while RUNNING:
+        sleep_time = SLEEP_TIME
         try:
             # 1. Periodic Reboot to prevent memory leaks
             if time.time() - LAST_REBOOT > REBOOT_LIMIT:
@@ -40,7 +50,7 @@ def main():
 
             # 2. Cycle with Watchdog
             start = time.time()
-            run_bot_cycle()
+            sleep_time = run_bot_cycle()
             
             elapsed = time.time() - start
             if elapsed > WATCHDOG_LIMIT:
@@ -57,9 +67,9 @@ def main():
 
         except Exception as e:
             print(f"Error: {e}")
-            time.sleep(10)
+            sleep_while_running(10)
         finally:
-            if RUNNING: time.sleep(SLEEP_TIME)
+            sleep_while_running(sleep_time)
 
     print("🛑 Shutdown.")
     shutdown_bot()